@@ -1,37 +1,52 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from app.models import (
     QueryRequest, QueryResponse,
+    BatchQueryRequest, BatchQueryResponse,
     AgentRequest, NetworkAgentResponse, CriteriaAgentResponse
 )
 import logging
-import json
-import datetime
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler
 import os
-from db.database import engine, SessionLocal
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.database import engine, get_db
 from db.models import Base
 from app.rag_core import (
     answer_question_with_memory,
+    answer_question_with_memory_stream,
     answer_network_guidance,
-    answer_criteria_grid
+    answer_criteria_grid,
+    close_clients
 )
 
-Base.metadata.create_all(bind=engine)
-
 app = FastAPI(
     title="SBG RAG API",
     description="Azure AI Search powered RAG API for Copilot Studio",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# Enable CORS for Copilot Studio
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# CORS is only needed for browser-facing callers; Copilot Studio talks to
+# this API server-to-server. Opt in with a comma-separated origin list so
+# the middleware (and its per-request header work) is skipped by default.
+# Note: wildcard origins with credentials are invalid per the CORS spec.
+_cors_origins = [
+    o.strip() for o in os.environ.get("CORS_ALLOW_ORIGINS", "").split(",") if o.strip()
+]
+if _cors_origins:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=_cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
 
 # Configure logging
 logging.basicConfig(
@@ -40,6 +55,96 @@ logging.basicConfig(
 )
 logger = logging.getLogger("audit_logger")
 
+# Flush thresholds for the batching audit listener
+AUDIT_BATCH_MAX = int(os.environ.get("AUDIT_BATCH_MAX", 100))
+AUDIT_BATCH_MS = int(os.environ.get("AUDIT_BATCH_MS", 50))
+
+
+class BatchingQueueListener:
+    """
+    Drains audit records from the queue on a background thread and writes
+    them as one JSON array per flush instead of one line per record.
+    Flushes when AUDIT_BATCH_MAX records are pending or AUDIT_BATCH_MS ms
+    have passed since the first pending record.
+    """
+
+    _SENTINEL = object()
+
+    def __init__(self, record_queue, batch_max: int = AUDIT_BATCH_MAX, batch_ms: int = AUDIT_BATCH_MS):
+        self.queue = record_queue
+        self.batch_max = batch_max
+        self.batch_wait = batch_ms / 1000.0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread:
+            self.queue.put_nowait(self._SENTINEL)
+            self._thread.join()
+            self._thread = None
+
+    @staticmethod
+    def _flush(batch):
+        if batch:
+            sys.stdout.buffer.write(orjson.dumps(batch) + b"\n")
+            sys.stdout.buffer.flush()
+            batch.clear()
+
+    def _monitor(self):
+        batch = []
+        deadline = 0.0
+        while True:
+            try:
+                if batch:
+                    record = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                else:
+                    record = self.queue.get()
+            except queue.Empty:
+                self._flush(batch)
+                continue
+            if record is self._SENTINEL:
+                self._flush(batch)
+                break
+            if not batch:
+                deadline = time.monotonic() + self.batch_wait
+            batch.append({"msg": record.getMessage(), **getattr(record, "audit", {})})
+            if len(batch) >= self.batch_max or time.monotonic() >= deadline:
+                self._flush(batch)
+
+
+# Audit records go through a queue: the request path only does a queue.put,
+# formatting and stdout I/O happen on the listener's background thread
+_audit_queue = queue.Queue(-1)
+logger.addHandler(QueueHandler(_audit_queue))
+logger.propagate = False
+_audit_listener = BatchingQueueListener(_audit_queue)
+
+
+def _ensure_indexes(sync_conn):
+    # create_all skips tables that already exist, and the repo ships a
+    # populated db/chat.db whose messages table predates the hot-path
+    # indexes — create them explicitly so existing databases get them too
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
+@app.on_event("startup")
+async def init_db():
+    _audit_listener.start()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_ensure_indexes)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_clients()
+    _audit_listener.stop()
+
 
 @app.get("/")
 def root():
@@ -57,83 +162,161 @@ def health_check():
     return {"status": "healthy"}
 
 
-@app.post("/rag/query", response_model=QueryResponse)
-def rag_query(request: QueryRequest):
-    db = SessionLocal()
+# response_model=None: these payloads are built server-side from typed
+# results, so Pydantic re-validation on the way out is redundant work.
+# model_construct skips the validation pipeline entirely.
+@app.post("/rag/query", response_model=None)
+async def rag_query(request: QueryRequest, db: AsyncSession = Depends(get_db)) -> QueryResponse:
     try:
-        result = answer_question_with_memory(request.query, request.session_id, db)
-        audit_log = {
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "session_id": result.get("session_id"),
-            "user_query": request.query,
-            "ai_answer": result.get("answer"),
-            "source_documents": result.get("sources"),
-            "status": "SUCCESS"
-        }
-        logger.info("AUDIT_LOG: %s", json.dumps(audit_log))
-        return result
+        result = await answer_question_with_memory(request.query, request.session_id, db)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": result.get("session_id"),
+                "user_query": request.query,
+                "ai_answer": result.get("answer"),
+                "source_documents": result.get("sources"),
+                "status": "SUCCESS"
+            }})
+        return QueryResponse.model_construct(
+            session_id=result["session_id"],
+            answer=result["answer"],
+            sources=result["sources"]
+        )
     except Exception as e:
-        audit_log = {
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "session_id": getattr(request, "session_id", None),
-            "user_query": request.query,
-            "error": str(e),
-            "status": "ERROR"
-        }
-        logger.error("AUDIT_LOG: %s", json.dumps(audit_log))
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": getattr(request, "session_id", None),
+                "user_query": request.query,
+                "error": str(e),
+                "status": "ERROR"
+            }})
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
-    finally:
-        db.close()
+
+
+@app.post("/rag/batch_query", response_model=None)
+async def rag_batch_query(request: BatchQueryRequest, db: AsyncSession = Depends(get_db)) -> BatchQueryResponse:
+    """
+    Answer several queries for one session in a single request. Queries
+    are processed in order so session memory behaves exactly as if they
+    had been sent one by one, but routing/middleware/connection overhead
+    is paid once per batch instead of once per question.
+    """
+    try:
+        session_id = request.session_id
+        answers = []
+        sources = []
+        for query in request.queries:
+            result = await answer_question_with_memory(query, session_id, db)
+            session_id = result["session_id"]
+            answers.append(result["answer"])
+            sources.append(result["sources"])
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": session_id,
+                "user_query_count": len(request.queries),
+                "status": "SUCCESS"
+            }})
+        return BatchQueryResponse.model_construct(
+            session_id=session_id,
+            answers=answers,
+            sources=sources
+        )
+    except Exception as e:
+        if logger.isEnabledFor(logging.ERROR):
+            logger.error("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": getattr(request, "session_id", None),
+                "user_query_count": len(request.queries),
+                "error": str(e),
+                "status": "ERROR"
+            }})
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+
+@app.post("/rag/stream")
+async def rag_stream(request: QueryRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Server-sent-events variant of /rag/query: tokens are sent as they
+    arrive instead of buffering the full completion, so first-byte
+    latency is the model's first token rather than the whole generation.
+    """
+    async def sse_iter():
+        session_id = request.session_id
+        async for event in answer_question_with_memory_stream(request.query, request.session_id, db):
+            session_id = event.get("session_id", session_id)
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": session_id,
+                "user_query": request.query,
+                "stream": True,
+                "status": "SUCCESS"
+            }})
+
+    return StreamingResponse(sse_iter(), media_type="text/event-stream")
 
 
 # =========================
 # NEW ENDPOINTS (SUB-AGENTS)
 # =========================
 
-@app.post("/agents/network", response_model=NetworkAgentResponse)
-def network_agent(request: AgentRequest):
-    db = SessionLocal()
+@app.post("/agents/network", response_model=None)
+async def network_agent(request: AgentRequest, db: AsyncSession = Depends(get_db)) -> NetworkAgentResponse:
     try:
-        result = answer_network_guidance(request.query, request.session_id, db)
-        audit_log = {
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "session_id": result.get("session_id"),
-            "user_query": request.query,
-            "agent": "network",
-            "status": "SUCCESS"
-        }
-        logger.info("AUDIT_LOG: %s", json.dumps(audit_log))
-        return result
+        result = await answer_network_guidance(request.query, request.session_id, db)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": result.get("session_id"),
+                "user_query": request.query,
+                "agent": "network",
+                "status": "SUCCESS"
+            }})
+        return NetworkAgentResponse.model_construct(
+            session_id=result["session_id"],
+            guidance=result["guidance"],
+            sources=result["sources"]
+        )
     except Exception as e:
         logger.error(f"Network Agent Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 
-@app.post("/agents/criteria", response_model=CriteriaAgentResponse)
-def criteria_agent(request: AgentRequest):
-    db = SessionLocal()
+@app.post("/agents/criteria", response_model=None)
+async def criteria_agent(request: AgentRequest, db: AsyncSession = Depends(get_db)) -> CriteriaAgentResponse:
     try:
-        result = answer_criteria_grid(request.query, request.session_id, db)
-        audit_log = {
-            "timestamp": datetime.datetime.utcnow().isoformat(),
-            "session_id": result.get("session_id"),
-            "user_query": request.query,
-            "agent": "criteria",
-            "status": "SUCCESS"
-        }
-        logger.info("AUDIT_LOG: %s", json.dumps(audit_log))
-        return result
+        result = await answer_criteria_grid(request.query, request.session_id, db)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("AUDIT_LOG", extra={"audit": {
+                "timestamp": time.time_ns(),
+                "session_id": result.get("session_id"),
+                "user_query": request.query,
+                "agent": "criteria",
+                "status": "SUCCESS"
+            }})
+        return CriteriaAgentResponse.model_construct(
+            session_id=result["session_id"],
+            evaluation=result["evaluation"],
+            sources=result["sources"]
+        )
     except Exception as e:
         logger.error(f"Criteria Agent Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
 
 
-# For local development
+# For local development (production runs under gunicorn, see Dockerfile)
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count())),
+        loop="uvloop",
+        http="httptools"
+    )
@@ -1,21 +1,42 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class QueryRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     query: str
-    session_id: Optional[str] = None
+    session_id: str | None = None
 
 
 class Source(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     document: str
     chunk_id: int
 
 
 class QueryResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     session_id: str
     answer: str
-    sources: Optional[List[str]] = []
+    sources: list[str] = Field(default_factory=list)
+
+
+class BatchQueryRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
+    # An empty batch has no session to resolve and nothing to answer
+    queries: list[str] = Field(min_length=1)
+    session_id: str | None = None
+
+
+class BatchQueryResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    session_id: str
+    answers: list[str] = Field(default_factory=list)
+    sources: list[list[str]] = Field(default_factory=list)
 
 
 # =========================
@@ -23,17 +44,23 @@ class QueryResponse(BaseModel):
 # =========================
 
 class AgentRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     query: str
-    session_id: Optional[str] = None
+    session_id: str | None = None
 
 
 class NetworkAgentResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     session_id: str
     guidance: str
-    sources: Optional[List[str]] = []
+    sources: list[str] = Field(default_factory=list)
 
 
 class CriteriaAgentResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
     session_id: str
     evaluation: str
-    sources: Optional[List[str]] = []
+    sources: list[str] = Field(default_factory=list)
@@ -1,18 +1,24 @@
+import asyncio
+import hashlib
 import os
+from functools import lru_cache
 from urllib.parse import urlparse
+import httpx
+import numpy as np
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from azure.search.documents import SearchClient
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.search.documents.aio import SearchClient
 from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 
 # Load environment variables from .env file FIRST
 load_dotenv()
 
-from db.database import SessionLocal
 from app.session_manager import (
     get_or_create_session,
-    save_message,
+    save_messages,
     get_chat_history
 )
 
@@ -58,34 +64,113 @@ if not AZURE_OPENAI_CHAT_DEPLOYMENT:
 
 credential = AzureKeyCredential(SEARCH_API_KEY)
 
-search_client = SearchClient(
-    endpoint=SEARCH_ENDPOINT,
-    index_name=INDEX_NAME,
-    credential=credential
+# One pooled HTTP/2 client shared by all Azure OpenAI calls; the SDK default
+# pool (~10 connections) becomes the bottleneck under event-loop concurrency
+shared_http = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+    timeout=httpx.Timeout(30.0, connect=5.0)
 )
 
-openai_client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-    api_version=AZURE_OPENAI_API_VERSION
-)
+
+# Async clients: requests await network I/O instead of blocking a worker thread,
+# so one event loop can multiplex many in-flight RAG calls.
+# Cached so dependency injection and direct callers share one instance.
+@lru_cache(maxsize=1)
+def get_search_client() -> SearchClient:
+    return SearchClient(
+        endpoint=SEARCH_ENDPOINT,
+        index_name=INDEX_NAME,
+        credential=credential,
+        transport=AioHttpTransport()
+    )
+
+
+@lru_cache(maxsize=1)
+def get_openai_client() -> AsyncAzureOpenAI:
+    return AsyncAzureOpenAI(
+        api_key=AZURE_OPENAI_API_KEY,
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_version=AZURE_OPENAI_API_VERSION,
+        http_client=shared_http
+    )
+
+
+search_client = get_search_client()
+openai_client = get_openai_client()
+
+
+async def close_clients():
+    """Release pooled connections; called from the app shutdown event."""
+    await search_client.close()
+    await shared_http.aclose()
 
 CHAT_HISTORY_LIMIT = 6
 
+# Chat UIs repeat queries often; caching trades a few MB of RAM for the
+# full Azure OpenAI / Azure Search round-trip on a hit
+EMBED_CACHE = TTLCache(maxsize=10_000, ttl=3600)
+DOCS_CACHE = TTLCache(maxsize=2_000, ttl=3600)
+
+
+def _cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.strip().lower().encode(), digest_size=16).digest()
+
+
+def _quantize_embedding(vec):
+    """
+    Symmetric int8 quantization: one contiguous 1-byte-per-dim buffer plus
+    a float scale, ~4x smaller than the FP32 list the API returns.
+    """
+    arr = np.asarray(vec, dtype=np.float32)
+    scale = float(np.max(np.abs(arr)) / 127.0) or 1.0
+    return scale, np.round(arr / scale).astype(np.int8)
+
+
+def _dequantize_embedding(scale, quantized):
+    return (quantized.astype(np.float32) * scale).tolist()
+
+# Prompt constants hoisted out of the request path so they are built once
+BASE_SYSTEM_PROMPT = (
+    "You are a compliance-safe assistant. "
+    "Answer strictly using the provided context when available. "
+    "If the answer is not in the context, say so."
+)
+
+def _build_context(docs) -> str:
+    return "\n\n".join(
+        f"[{d['filename']} – chunk {d['chunk_id']}]\n{d['content']}"
+        for d in docs
+    )
+
+
+async def generate_embedding(text: str):
+    key = _cache_key(text)
+    cached = EMBED_CACHE.get(key)
+    if cached is not None:
+        return _dequantize_embedding(*cached)
 
-def generate_embedding(text: str):
     try:
-        response = openai_client.embeddings.create(
+        response = await openai_client.embeddings.create(
             model=AZURE_OPENAI_EMBED_DEPLOYMENT,
             input=text
         )
-        return response.data[0].embedding
     except Exception as e:
         raise RuntimeError(f"OpenAI Embeddings (404=wrong endpoint/deployment name): {e}") from e
 
+    embedding = response.data[0].embedding
+    EMBED_CACHE[key] = _quantize_embedding(embedding)
+    return embedding
+
 
-def retrieve_documents(query: str, top_k: int = 5):
-    vector = generate_embedding(query)
+async def retrieve_documents(query: str, top_k: int = 5, vector: list[float] | None = None):
+    docs_key = (_cache_key(query), top_k)
+    cached = DOCS_CACHE.get(docs_key)
+    if cached is not None:
+        return cached
+
+    if vector is None:
+        vector = await generate_embedding(query)
 
     vector_query = VectorizedQuery(
         vector=vector,
@@ -94,62 +179,71 @@ def retrieve_documents(query: str, top_k: int = 5):
     )
 
     try:
-        results = search_client.search(
+        results = await search_client.search(
             search_text=query,
             vector_queries=[vector_query],
             select=["content", "filename", "chunk_id"],
             top=top_k
         )
+        documents = []
+        async for r in results:
+            documents.append({
+                "content": r["content"],
+                "filename": r["filename"],
+                "chunk_id": r["chunk_id"],
+                "score": r["@search.score"]
+            })
     except Exception as e:
         raise RuntimeError(f"Azure Search (404=wrong index/endpoint): {e}") from e
 
-    documents = []
-    for r in results:
-        documents.append({
-            "content": r["content"],
-            "filename": r["filename"],
-            "chunk_id": r["chunk_id"],
-            "score": r["@search.score"]
-        })
-
+    DOCS_CACHE[docs_key] = documents
     return documents
 
 
-def answer_question(question: str):
-    docs = retrieve_documents(question)
+async def _prepare_turn(question: str, session_id: str | None, db):
+    """
+    Shared setup for a memory-aware turn: resolve the session, persist the
+    user message, retrieve context and assemble the chat messages.
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession
+    if not isinstance(db, AsyncSession):
+        raise TypeError("db must be a SQLAlchemy AsyncSession")
 
-    if not docs:
-        return {
-            "answer": "I cannot find this information in the available documents.",
-            "sources": []
-        }
+    session_id = await get_or_create_session(db, session_id)
 
-    context = "\n\n".join(
-        f"[{d['filename']} – chunk {d['chunk_id']}]\n{d['content']}"
-        for d in docs
+    # Embedding (OpenAI HTTP) and chat history (local DB) are independent;
+    # overlap their I/O instead of paying both latencies back to back
+    history, vector = await asyncio.gather(
+        get_chat_history(db, session_id, limit=CHAT_HISTORY_LIMIT),
+        generate_embedding(question)
     )
+    docs = await retrieve_documents(question, vector=vector)
 
-    system_prompt = (
-        "You are a compliance-safe assistant. "
-        "Answer strictly using the provided context. "
-        "If the answer is not present, say so."
-    )
+    context = _build_context(docs) if docs else ""
 
-    user_prompt = f"""
-Context:
-{context}
+    system_prompt = f"{BASE_SYSTEM_PROMPT}\n\nContext from documents:\n{context}" if context else BASE_SYSTEM_PROMPT
+
+    # The current question is appended directly; both turn messages are
+    # persisted together once the answer is known
+    openai_messages = [{"role": "system", "content": system_prompt}]
+    for m in history:
+        openai_messages.append({"role": m.role, "content": m.content})
+    openai_messages.append({"role": "user", "content": question})
 
-Question:
-{question}
-"""
+    return session_id, docs, openai_messages
+
+
+def _format_sources(docs):
+    return [f"{d['filename']} (chunk {d['chunk_id']})" for d in docs] if docs else []
+
+
+async def answer_question_with_memory(question: str, session_id: str | None, db):
+    session_id, docs, openai_messages = await _prepare_turn(question, session_id, db)
 
     try:
-        response = openai_client.chat.completions.create(
+        response = await openai_client.chat.completions.create(
             model=AZURE_OPENAI_CHAT_DEPLOYMENT,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            messages=openai_messages,
             temperature=0,
             max_tokens=800
         )
@@ -158,76 +252,57 @@ Question:
 
     answer = response.choices[0].message.content
 
-    sources = [
-        {
-            "document": d["filename"],
-            "chunk_id": d["chunk_id"]
-        }
-        for d in docs
-    ]
-
-    return {
-        "answer": answer,
-        "sources": sources
-    }
-
-
-def answer_question_with_memory(question: str, session_id: str | None, db):
-    from sqlalchemy.orm import Session
-    if not isinstance(db, Session):
-        raise TypeError("db must be a SQLAlchemy Session")
+    # One bulk insert for both turn messages, one commit for the whole turn
+    await save_messages(db, session_id, [("user", question), ("assistant", answer)])
+    await db.commit()
 
-    session_id = get_or_create_session(db, session_id)
-    save_message(db, session_id, "user", question)
+    return {"session_id": session_id, "answer": answer, "sources": _format_sources(docs)}
 
-    history = get_chat_history(db, session_id, limit=CHAT_HISTORY_LIMIT)
-    docs = retrieve_documents(question)
-
-    context = ""
-    if docs:
-        context = "\n\n".join(
-            f"[{d['filename']} – chunk {d['chunk_id']}]\n{d['content']}"
-            for d in docs
-        )
-
-    base_system = (
-        "You are a compliance-safe assistant. "
-        "Answer strictly using the provided context when available. "
-        "If the answer is not in the context, say so."
-    )
 
-    system_prompt = f"{base_system}\n\nContext from documents:\n{context}" if context else base_system
+async def answer_question_with_memory_stream(question: str, session_id: str | None, db):
+    """
+    Streaming variant of answer_question_with_memory. Yields wire-ready
+    events: first {"session_id"}, then {"delta"} per token, finally
+    {"done", "sources"}. The assistant message is persisted once the
+    stream completes.
+    """
+    session_id, docs, openai_messages = await _prepare_turn(question, session_id, db)
 
-    openai_messages = [{"role": "system", "content": system_prompt}]
-    for m in history:
-        openai_messages.append({"role": m.role, "content": m.content})
+    yield {"session_id": session_id}
 
+    parts = []
     try:
-        response = openai_client.chat.completions.create(
+        stream = await openai_client.chat.completions.create(
             model=AZURE_OPENAI_CHAT_DEPLOYMENT,
             messages=openai_messages,
             temperature=0,
-            max_tokens=800
+            max_tokens=800,
+            stream=True
         )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                delta = chunk.choices[0].delta.content
+                parts.append(delta)
+                yield {"delta": delta}
     except Exception as e:
         raise RuntimeError(f"OpenAI Chat (404=wrong endpoint/deployment name): {e}") from e
 
-    answer = response.choices[0].message.content
-    save_message(db, session_id, "assistant", answer)
+    answer = "".join(parts)
+    await save_messages(db, session_id, [("user", question), ("assistant", answer)])
+    await db.commit()
 
-    sources = [f"{d['filename']} (chunk {d['chunk_id']})" for d in docs] if docs else []
-    return {"session_id": session_id, "answer": answer, "sources": sources}
+    yield {"done": True, "sources": _format_sources(docs)}
 
 
 # =========================
 # NEW AGENT FUNCTIONS
 # =========================
 
-def answer_network_guidance(question: str, session_id: str | None, db):
+async def answer_network_guidance(question: str, session_id: str | None, db):
     """
     Network Guidance Agent using the SAME Azure AI Search index.
     """
-    result = answer_question_with_memory(question, session_id, db)
+    result = await answer_question_with_memory(question, session_id, db)
     guidance = "Network Guidance (based on indexed documents):\n\n" + result["answer"]
     return {
         "session_id": result["session_id"],
@@ -236,11 +311,11 @@ def answer_network_guidance(question: str, session_id: str | None, db):
     }
 
 
-def answer_criteria_grid(question: str, session_id: str | None, db):
+async def answer_criteria_grid(question: str, session_id: str | None, db):
     """
     Criteria Grid Agent using the SAME Azure AI Search index.
     """
-    result = answer_question_with_memory(question, session_id, db)
+    result = await answer_question_with_memory(question, session_id, db)
     evaluation = "Criteria Evaluation (based on indexed documents):\n\n" + result["answer"]
     return {
         "session_id": result["session_id"],
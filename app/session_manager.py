@@ -1,61 +1,75 @@
 import uuid
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import select, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from db.models import Session as SessionModel, Message
 
 
-def get_or_create_session(db: Session, session_id: str | None) -> str:
+async def get_or_create_session(db: AsyncSession, session_id: str | None) -> str:
     """
     Get existing session or create a new one.
     Updates last_active timestamp on access.
+    Does not commit; the caller owns the transaction.
     """
     if session_id:
-        session = db.query(SessionModel).filter_by(session_id=session_id).first()
-        if session:
-            session.last_active = datetime.utcnow()
-            db.commit()
-            return session.session_id
+        result = await db.execute(
+            select(SessionModel.session_id).filter_by(session_id=session_id)
+        )
+        existing = result.scalar_one_or_none()
+        if existing:
+            await db.execute(
+                update(SessionModel)
+                .where(SessionModel.session_id == existing)
+                .values(last_active=datetime.utcnow())
+            )
+            return existing
 
     new_id = str(uuid.uuid4())
-    session = SessionModel(
-        session_id=new_id,
-        created_at=datetime.utcnow(),
-        last_active=datetime.utcnow()
+    now = datetime.utcnow()
+    await db.execute(
+        insert(SessionModel).values(
+            session_id=new_id,
+            created_at=now,
+            last_active=now
+        )
     )
-    db.add(session)
-    db.commit()
     return new_id
 
 
-def save_message(db: Session, session_id: str, role: str, content: str) -> None:
+async def save_messages(db: AsyncSession, session_id: str, turns) -> None:
     """
-    Save a single chat message and update session last_active.
+    Bulk-insert chat messages (one statement for the whole turn) and
+    update session last_active. Core inserts skip the ORM identity-map
+    and flush machinery. Does not commit; the caller owns the transaction.
     """
-    msg = Message(
-        session_id=session_id,
-        role=role,
-        content=content,
-        created_at=datetime.utcnow()
+    now = datetime.utcnow()
+    await db.execute(
+        insert(Message).values([
+            {
+                "session_id": session_id,
+                "role": role,
+                "content": content,
+                "created_at": now
+            }
+            for role, content in turns
+        ])
+    )
+    await db.execute(
+        update(SessionModel)
+        .where(SessionModel.session_id == session_id)
+        .values(last_active=now)
     )
-    db.add(msg)
-
-    # Update session activity
-    session = db.query(SessionModel).filter_by(session_id=session_id).first()
-    if session:
-        session.last_active = datetime.utcnow()
-
-    db.commit()
 
 
-def get_chat_history(db: Session, session_id: str, limit: int = 6):
+async def get_chat_history(db: AsyncSession, session_id: str, limit: int = 6):
     """
     Get last N messages in chronological order.
     """
-    messages = (
-        db.query(Message)
+    result = await db.execute(
+        select(Message.role, Message.content)
         .filter_by(session_id=session_id)
         .order_by(Message.created_at.desc())
         .limit(limit)
-        .all()
     )
+    messages = result.all()
     return list(reversed(messages))
@@ -1,17 +1,35 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from functools import lru_cache
 
-DATABASE_URL = "sqlite:///./db/chat.db"
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+
+DATABASE_URL = "sqlite+aiosqlite:///./db/chat.db"
+
+
+@lru_cache(maxsize=1)
+def get_engine():
+    return create_async_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False},
+        pool_size=20,
+        max_overflow=40,
+        pool_pre_ping=True
+    )
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False}
-)
 
-SessionLocal = sessionmaker(
-    autocommit=False,
+engine = get_engine()
+
+SessionLocal = async_sessionmaker(
     autoflush=False,
+    expire_on_commit=False,
     bind=engine
 )
 
+
+async def get_db():
+    """FastAPI dependency yielding a per-request AsyncSession."""
+    async with SessionLocal() as db:
+        yield db
+
+
 Base = declarative_base()
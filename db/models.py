@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Integer, ForeignKey
+from sqlalchemy import Column, String, DateTime, Integer, ForeignKey, Index
 from datetime import datetime
 from .database import Base
 
@@ -12,9 +12,13 @@ class Session(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    # Covers get_chat_history's filter + ORDER BY created_at DESC LIMIT N
+    __table_args__ = (
+        Index("ix_messages_session_created", "session_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String, ForeignKey("sessions.session_id"))
+    session_id = Column(String, ForeignKey("sessions.session_id"), index=True)
     role = Column(String)  # user / assistant
     content = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
